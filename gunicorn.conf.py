@@ -0,0 +1,23 @@
+# Gunicorn configuration for the Flask API
+# The web process only validates requests, queues Celery tasks and polls
+# results, so it is I/O bound - gevent workers let each process hold many
+# concurrent requests instead of one
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+worker_class = 'gevent'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2))
+worker_connections = 1000
+
+# The app must be imported after monkey-patching, i.e. inside each worker
+preload_app = False
+
+def post_fork(server, worker):
+    """Switch gRPC (used by Firestore) to gevent-compatible I/O in each worker.
+    
+    The gevent worker monkey-patches the stdlib itself before loading main:app,
+    but gRPC's C core does its own socket I/O and needs this separate hook.
+    """
+    import grpc.experimental.gevent as grpc_gevent
+    grpc_gevent.init_gevent()
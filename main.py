@@ -1,19 +1,149 @@
-from flask import Flask, request, jsonify
-import speech_recognition as sr
+from flask import Flask, Response, request
+import orjson
+from flask_compress import Compress
 import requests
-import tempfile
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import sys
 import json
-from pydub import AudioSegment
+import atexit
+import logging
+import logging.handlers
+import hashlib
+import itertools
+import queue
+import struct
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import redis
 import firebase_admin
 from firebase_admin import credentials, firestore
 from dotenv import load_dotenv
+from celery import Celery
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
 
 # Load environment variables
 load_dotenv()
 
+# Log through a queue so request handlers never block on stderr writes - a
+# background listener thread does the actual I/O
+log_queue = queue.Queue(-1)
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+queue_handler = logging.handlers.QueueHandler(log_queue)
+
+log = logging.getLogger('voice')
+log.addHandler(queue_handler)
+log.setLevel(logging.INFO)
+log.propagate = False
+
+log_listener.start()
+
+def stop_log_listener():
+    """Flush queued records and stop this process's listener thread"""
+    log_listener.stop()
+
+atexit.register(stop_log_listener)
+
+def restart_log_listener():
+    """Give forked children (Celery prefork workers) their own listener thread"""
+    global log_queue, log_listener
+    log_queue = queue.Queue(-1)
+    queue_handler.queue = log_queue
+    log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+    log_listener.start()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=restart_log_listener)
+
 app = Flask(__name__)
 
+# Compress JSON responses (long transcripts compress very well)
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = 500
+Compress(app)
+
+# Celery task queue - transcription runs in background workers so the
+# Flask process never blocks on download / ffmpeg / model inference
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', CELERY_BROKER_URL)
+
+celery = Celery('voice', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+celery.conf.update(
+    task_track_started=True,
+    result_expires=3600,
+    # Heavy ffmpeg/transcription jobs get their own queue so they don't
+    # starve lightweight tasks. Tasks have explicit names so routing works
+    # whether this module is imported as `main` or run as `__main__`
+    task_routes={
+        'transcribe_task': {'queue': 'transcription'},
+        'transcribe_batch_task': {'queue': 'transcription'},
+        'save_transcription_task': {'queue': 'firestore'},
+    },
+)
+
+# Transcription cache keyed by SHA-256 of the audio bytes, plus a URL -> hash
+# index so stable URLs skip the download too. The cache is only enabled when
+# REDIS_URL points at a dedicated Redis instance - never the Celery broker.
+# Give that instance a bounded maxmemory and `maxmemory-policy allkeys-lru`.
+# If it must share a server with other data, use `volatile-lru` instead so
+# only these TTL'd keys can be evicted.
+REDIS_URL = os.environ.get('REDIS_URL')
+CACHE_TTL = int(os.environ.get('TRANSCRIPTION_CACHE_TTL', 86400))
+# Storage URLs keep their token when the object is overwritten, so the
+# URL -> hash index only lives briefly before the audio is re-downloaded
+URL_CACHE_TTL = int(os.environ.get('URL_CACHE_TTL', 300))
+
+cache = redis.Redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+
+# Shared HTTP session so audio downloads reuse pooled TCP/TLS connections
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_maxsize=32, max_retries=Retry(total=3, backoff_factor=0.2))
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+# PCM format fed to the model: 16kHz, mono, 16-bit
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+PCM_SCALE = 1.0 / 32768.0  # Python float - keeps an in-place float32 multiply in float32
+
+# Voice activity filtering is opt-in and only applied to clips longer than
+# this, since on short utterances it can drop meaningful speech
+DENOISE_MIN_SECONDS = 1.0
+
+# ffmpeg pipe buffer size - large pipes mean far fewer read/write syscalls
+PIPE_BUFSIZE = 1 << 20
+
+# Pool of reusable download buffers, sized to a typical clip, so WAV uploads
+# don't allocate a fresh clip-sized buffer per request
+BUFFER_SIZE = 2 * 1024 * 1024
+BUFFER_MAX_SIZE = 8 * 1024 * 1024
+BUFFER_POOL = queue.Queue(maxsize=32)
+
+# Batch requests: max URLs per request and concurrent download/transcribe jobs
+MAX_BATCH_SIZE = 50
+BATCH_WORKERS = 8
+
+# Local Whisper model (CTranslate2, int8) - loaded once per worker process.
+# numpy / ctranslate2 / faster_whisper are imported lazily so the web
+# workers, which never run inference, don't pay for them
+WHISPER_MODEL = os.environ.get('WHISPER_MODEL', 'base.en')
+MODEL = None
+model_lock = threading.Lock()
+
+def json_response(data, status=200):
+    """Build a JSON response with orjson (much faster than jsonify)"""
+    return Response(orjson.dumps(data), status=status, mimetype='application/json')
+
 # Initialize Firebase Admin SDK
 def initialize_firebase():
     """Initialize Firebase with environment variable or local file"""
@@ -22,19 +152,14 @@ def initialize_firebase():
         firebase_key_json = os.environ.get('FIREBASE_SERVICE_ACCOUNT_KEY')
         
         if firebase_key_json:
-            print("Using Firebase key from environment variable")
-            # Parse JSON from environment variable
+            log.info("Using Firebase key from environment variable")
+            # Parse JSON from environment variable - Certificate accepts the
+            # dict directly, so no key file is written to disk
             key_dict = json.loads(firebase_key_json)
-            
-            # Create temporary file for the key
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp_file:
-                json.dump(key_dict, temp_file)
-                temp_key_path = temp_file.name
-            
-            cred = credentials.Certificate(temp_key_path)
+            cred = credentials.Certificate(key_dict)
         else:
             # Fallback to local file for development
-            print("Using local Firebase key file")
+            log.info("Using local Firebase key file")
             local_key_path = "./keys/serviceAccountKey.json"
             if os.path.exists(local_key_path):
                 cred = credentials.Certificate(local_key_path)
@@ -44,216 +169,614 @@ def initialize_firebase():
         # Initialize Firebase app if not already initialized
         if not firebase_admin._apps:
             firebase_admin.initialize_app(cred)
-            print("Firebase initialized successfully")
+            log.info("Firebase initialized successfully")
         
         return firestore.client()
         
     except Exception as e:
-        print(f"Error initializing Firebase: {e}")
+        log.error(f"Error initializing Firebase: {e}")
         raise
 
 # Initialize Firebase and get Firestore client
 try:
     db = initialize_firebase()
 except Exception as e:
-    print(f"Failed to initialize Firebase: {e}")
+    log.error(f"Failed to initialize Firebase: {e}")
     db = None
 
-def download_audio_file(audio_url):
-    """Download audio file from URL to temporary file"""
+# Health check values never change after startup - compute them once
+FIREBASE_STATUS = "connected" if db is not None else "not connected"
+PYTHON_VERSION = f"{sys.version_info.major}.{sys.version_info.minor}"
+ENVIRONMENT = 'production' if os.environ.get('FIREBASE_SERVICE_ACCOUNT_KEY') else 'development'
+
+def transcription_cache_key(audio_hash, denoise=False):
+    """Cache key for a transcription - denoised results are cached separately"""
+    return f"tx:{audio_hash}:denoise" if denoise else f"tx:{audio_hash}"
+
+def get_cached_transcription(audio_url=None, audio_hash=None, denoise=False):
+    """Look up a cached transcription by audio hash or by URL"""
+    if cache is None:
+        return None
+    try:
+        if audio_hash is None and audio_url is not None:
+            audio_hash = cache.get(f"url:{audio_url}")
+        if audio_hash is None:
+            return None
+        return cache.get(transcription_cache_key(audio_hash, denoise))
+    except redis.RedisError as e:
+        log.error(f"Error reading transcription cache: {e}")
+        return None
+
+def cache_transcription(audio_hash, transcription, denoise=False):
+    """Store a successful transcription keyed by audio hash"""
+    if cache is None:
+        return
+    try:
+        cache.setex(transcription_cache_key(audio_hash, denoise), CACHE_TTL, transcription)
+    except redis.RedisError as e:
+        log.error(f"Error writing transcription cache: {e}")
+
+def cache_audio_url(audio_url, audio_hash):
+    """Remember which audio hash a URL served, for URL_CACHE_TTL seconds"""
+    if cache is None:
+        return
+    try:
+        cache.setex(f"url:{audio_url}", URL_CACHE_TTL, audio_hash)
+    except redis.RedisError as e:
+        log.error(f"Error writing URL cache: {e}")
+
+def iter_wav_chunks(data):
+    """Yield (chunk_id, offset, size) for each RIFF chunk present in data"""
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id, size = struct.unpack_from('<4sI', data, pos)
+        yield chunk_id, pos + 8, size
+        pos += 8 + size + (size & 1)
+
+def wav_format(data):
+    """Return (channels, sample_rate, bits) of a PCM WAV header, or None"""
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        return None
+    for chunk_id, offset, size in iter_wav_chunks(data):
+        if chunk_id == b'fmt ':
+            if size < 16 or offset + 16 > len(data):
+                return None
+            audio_format, channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', data, offset)
+            if audio_format != 1:  # Not integer PCM
+                return None
+            return channels, sample_rate, bits
+    return None
+
+def wav_pcm(data):
+    """Return the samples from the data chunk of a WAV file, or None"""
+    for chunk_id, offset, size in iter_wav_chunks(data):
+        if chunk_id == b'data':
+            return bytes(data[offset:offset + size])
+    return None
+
+def acquire_buffer():
+    """Take a reusable download buffer from the pool"""
     try:
-        print(f"Downloading audio from: {audio_url}")
-        response = requests.get(audio_url, timeout=30)
+        return BUFFER_POOL.get_nowait()
+    except queue.Empty:
+        return bytearray(BUFFER_SIZE)
+
+def release_buffer(buf):
+    """Return a download buffer to the pool - oversized buffers are dropped"""
+    if len(buf) > BUFFER_MAX_SIZE:
+        return
+    try:
+        BUFFER_POOL.put_nowait(buf)
+    except queue.Full:
+        pass
+
+def read_into_buffer(buf, chunks):
+    """Copy chunks into buf from the start, growing it if needed, returns the length"""
+    length = 0
+    for chunk in chunks:
+        end = length + len(chunk)
+        buf[length:end] = chunk
+        length = end
+    return length
+
+def ffmpeg_decode_file(body):
+    """Decode audio from a seekable temp file, returns 16kHz mono 16-bit PCM"""
+    with tempfile.NamedTemporaryFile(suffix='.audio', delete=False) as temp_file:
+        temp_file.write(body)
+        temp_path = temp_file.name
+    
+    try:
+        process = subprocess.run(
+            ['ffmpeg', '-v', 'error', '-i', temp_path,
+             '-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', '1', 'pipe:1'],
+            capture_output=True
+        )
+    except OSError as e:
+        log.error(f"Error starting ffmpeg: {e}")
+        raise RuntimeError(f"Error converting audio: {e}")
+    finally:
+        os.unlink(temp_path)
+    
+    if process.returncode != 0:
+        error = process.stderr.decode(errors='replace').strip() or f"ffmpeg exited with code {process.returncode}"
+        log.error(f"Error decoding audio: {error}")
+        raise RuntimeError(f"Error converting audio: {error}")
+    
+    return process.stdout
+
+def ffmpeg_decode(chunks, digest):
+    """Pipe audio chunks through ffmpeg, returns 16kHz mono 16-bit PCM.
+    
+    Chunks are fed to ffmpeg's stdin from a background thread while PCM is
+    read from its stdout, so the download overlaps decoding. Formats that
+    need a seekable input are retried from a temp file.
+    """
+    try:
+        process = subprocess.Popen(
+            ['ffmpeg', '-v', 'quiet', '-i', 'pipe:0',
+             '-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', '1', 'pipe:1'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=PIPE_BUFSIZE
+        )
+    except OSError as e:
+        log.error(f"Error starting ffmpeg: {e}")
+        raise RuntimeError(f"Error converting audio: {e}")
+    
+    # bufsize only sizes Python's side - also grow the kernel pipes (64 KiB by
+    # default on Linux) so ffmpeg's own reads and writes are batched
+    if fcntl is not None and hasattr(fcntl, 'F_SETPIPE_SZ'):
+        for pipe in (process.stdin, process.stdout):
+            try:
+                fcntl.fcntl(pipe.fileno(), fcntl.F_SETPIPE_SZ, PIPE_BUFSIZE)
+            except OSError:
+                # Capped by /proc/sys/fs/pipe-max-size - keep the default
+                pass
+    
+    feed_errors = []
+    # Downloaded bytes are kept so a failed pipe decode can be retried
+    body = []
+    
+    def feed_ffmpeg():
+        try:
+            for chunk in chunks:
+                digest.update(chunk)
+                body.append(chunk)
+                process.stdin.write(chunk)
+                # Don't let chunks sit in the 1 MiB Python-side buffer - ffmpeg
+                # should start decoding while the download is still running
+                process.stdin.flush()
+        except Exception as e:
+            # Download failure, or BrokenPipeError if ffmpeg exited early
+            feed_errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+    
+    feeder = threading.Thread(target=feed_ffmpeg, daemon=True)
+    feeder.start()
+    pcm = process.stdout.read()
+    returncode = process.wait()
+    feeder.join()
+    
+    for e in feed_errors:
+        if isinstance(e, requests.RequestException):
+            log.error(f"Error downloading audio: {e}")
+            raise e
+    if returncode != 0 or feed_errors:
+        # Containers with their index at the end - e.g. MP4/M4A with a
+        # trailing moov atom, as written by Android MediaRecorder - can't be
+        # decoded from a pipe. Finish the download and retry from a file.
+        error = feed_errors[0] if feed_errors else f"ffmpeg exited with code {returncode}"
+        log.warning(f"Pipe decode failed ({error}) - retrying from a seekable file")
+        for chunk in chunks:
+            digest.update(chunk)
+            body.append(chunk)
+        return ffmpeg_decode_file(b''.join(body))
+    
+    return pcm
+
+def download_and_decode(audio_url):
+    """Stream audio from URL to 16kHz mono 16-bit PCM, returns (pcm, sha256).
+    
+    Audio that is already 16kHz mono 16-bit WAV is used as-is; anything else
+    is streamed through ffmpeg, only touching disk if the format can't be
+    decoded from a pipe.
+    """
+    log.info(f"Downloading and decoding audio from: {audio_url}")
+    response = SESSION.get(audio_url, stream=True, timeout=30)
+    digest = hashlib.sha256()
+    
+    try:
+        # Inside the try so error responses still release their pooled connection
         response.raise_for_status()
+        chunks = response.iter_content(65536)
+        first_chunk = next(chunks, b'')
         
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.aac') as temp_file:
-            temp_file.write(response.content)
-            print(f"Audio downloaded to: {temp_file.name}")
-            return temp_file.name
-    except Exception as e:
-        print(f"Error downloading audio: {e}")
-        raise
+        if wav_format(first_chunk) == (1, SAMPLE_RATE, SAMPLE_WIDTH * 8):
+            # Already in the model's input format - skip ffmpeg entirely
+            buf = acquire_buffer()
+            try:
+                length = read_into_buffer(buf, itertools.chain([first_chunk], chunks))
+                with memoryview(buf)[:length] as body:
+                    digest.update(body)
+                    pcm = wav_pcm(body)
+            finally:
+                release_buffer(buf)
+            if pcm is None:
+                raise RuntimeError("Error converting audio: WAV file has no data chunk")
+            log.info("Audio is 16kHz mono PCM WAV - skipping ffmpeg")
+        else:
+            pcm = ffmpeg_decode(itertools.chain([first_chunk], chunks), digest)
+    finally:
+        response.close()
+    
+    audio_hash = digest.hexdigest()
+    cache_audio_url(audio_url, audio_hash)
+    
+    log.info(f"Audio decoded: {len(pcm)} bytes of PCM")
+    return pcm, audio_hash
 
-def convert_audio_to_wav(input_path):
-    """Convert audio file to WAV format for better speech recognition"""
+def get_model():
+    """Load the Whisper model on first use"""
+    global MODEL
+    with model_lock:
+        if MODEL is None:
+            import ctranslate2
+            from faster_whisper import WhisperModel
+            
+            if ctranslate2.get_cuda_device_count() > 0:
+                device, compute_type = 'cuda', 'int8_float16'
+            else:
+                device, compute_type = 'cpu', 'int8'
+            log.info(f"Loading Whisper model {WHISPER_MODEL} on {device} ({compute_type})")
+            MODEL = WhisperModel(WHISPER_MODEL, device=device, compute_type=compute_type)
+        return MODEL
+
+def transcribe_audio(pcm, denoise=False):
+    """Transcribe 16kHz mono PCM to text using the local Whisper model.
+    
+    Returns (text, success) - on failure text is a user-facing error message.
+    """
+    import numpy as np
+    
     try:
-        print(f"Converting audio file: {input_path}")
-        # Load audio file
-        audio = AudioSegment.from_file(input_path)
+        log.info(f"Transcribing {len(pcm)} bytes of audio")
+        
+        # Whisper expects float32 samples in [-1, 1] - scale in place by the
+        # reciprocal rather than allocating a second array for the division
+        samples = np.frombuffer(pcm, np.int16).astype(np.float32)
+        samples *= PCM_SCALE
+        
+        # Drop non-speech (noise, silence) before decoding when requested
+        vad_filter = denoise and len(pcm) > SAMPLE_RATE * SAMPLE_WIDTH * DENOISE_MIN_SECONDS
+        
+        segments, _ = get_model().transcribe(samples, language='en', beam_size=1, vad_filter=vad_filter)
+        text = ''.join(segment.text for segment in segments).strip()
         
-        # Convert to WAV with optimal settings for speech recognition
-        output_path = input_path.replace('.aac', '.wav')
-        audio = audio.set_frame_rate(16000).set_channels(1)  # Mono, 16kHz
-        audio.export(output_path, format='wav')
+        if not text:
+            error_msg = "Could not understand the audio - please speak clearly"
+            log.warning(f"Transcription error: {error_msg}")
+            return error_msg, False
+        
+        log.info(f"Transcription successful: {text[:50]}..." if len(text) > 50 else f"Transcription: {text}")
+        return text, True
         
-        print(f"Audio converted to: {output_path}")
-        return output_path
     except Exception as e:
-        print(f"Error converting audio: {e}")
-        # Return original path if conversion fails
-        return input_path
+        error_msg = f"Error during transcription: {e}"
+        log.error(f"General transcription error: {error_msg}")
+        return error_msg, False
 
-def transcribe_audio(audio_path):
-    """Transcribe audio file to text using Google Speech Recognition"""
-    recognizer = sr.Recognizer()
+def warm_up_model():
+    """Load the model and run a tiny transcription so the first request is fast"""
+    import numpy as np
     
     try:
-        print(f"Transcribing audio: {audio_path}")
-        
-        # Convert to WAV first for better compatibility
-        wav_path = convert_audio_to_wav(audio_path)
+        log.info("Warming up Whisper model")
+        silence = np.zeros(SAMPLE_RATE // 10, dtype=np.float32)
+        segments, _ = get_model().transcribe(silence, language='en', beam_size=1)
+        # Segments are generated lazily - consume them to run the decoder
+        list(segments)
+    except Exception as e:
+        log.error(f"Error warming up model: {e}")
+
+@worker_init.connect
+def on_worker_init(**kwargs):
+    """Download the model files once, in the main worker process.
+    
+    Unlike worker_process_init this may block, so a cold cache is filled
+    before the pool children start instead of by each child separately.
+    """
+    try:
+        from faster_whisper import download_model
         
-        with sr.AudioFile(wav_path) as source:
-            # Adjust for ambient noise
-            recognizer.adjust_for_ambient_noise(source, duration=0.5)
-            # Record the audio
-            audio_data = recognizer.record(source)
-            
-        # Transcribe using Google Speech Recognition (free tier)
-        text = recognizer.recognize_google(audio_data)
-        print(f"Transcription successful: {text[:50]}..." if len(text) > 50 else f"Transcription: {text}")
-        return text
-        
-    except sr.UnknownValueError:
-        error_msg = "Could not understand the audio - please speak clearly"
-        print(f"Transcription error: {error_msg}")
-        return error_msg
-    except sr.RequestError as e:
-        error_msg = f"Could not request results from speech recognition service: {e}"
-        print(f"Speech service error: {error_msg}")
-        return error_msg
+        log.info(f"Fetching Whisper model files for {WHISPER_MODEL}")
+        download_model(WHISPER_MODEL)
     except Exception as e:
-        error_msg = f"Error during transcription: {e}"
-        print(f"General transcription error: {error_msg}")
-        return error_msg
+        log.error(f"Error downloading Whisper model: {e}")
+
+@worker_process_shutdown.connect
+def on_worker_process_shutdown(**kwargs):
+    """Pool children exit via os._exit, which skips atexit - flush logs here"""
+    stop_log_listener()
+
+@worker_process_init.connect
+def on_worker_process_init(**kwargs):
+    """Warm up each Celery worker process in the background.
+    
+    Celery kills pool children whose worker_process_init handlers block for
+    more than a few seconds, so the slow warm-up must not run inline.
+    """
+    threading.Thread(target=warm_up_model, daemon=True).start()
+
+@celery.task(name='save_transcription_task', acks_late=True,
+             autoretry_for=(Exception,), retry_backoff=True, max_retries=5)
+def save_transcription_task(doc_id, transcription, audio_url):
+    """Background task: write a transcription document to Firestore"""
+    if db is None:
+        log.warning("Firestore not available - skipping save")
+        return
+    
+    db.collection('voice_transcriptions').document(doc_id).set({
+        'transcription': transcription,
+        'audio_url': audio_url,
+        'timestamp': firestore.SERVER_TIMESTAMP,
+        'treatment_page': 'Treatment Eight',
+        'processed_by': 'python_backend',
+        'status': 'completed'
+    })
+    log.info(f"Saved to Firestore with ID: {doc_id}")
 
 def save_to_firestore(transcription, audio_url):
-    """Save transcription to Firestore database"""
+    """Queue transcription save to Firestore database, returns the document ID"""
     if db is None:
-        print("Firestore not available - skipping save")
+        log.warning("Firestore not available - skipping save")
         return None
         
     try:
-        print("Saving transcription to Firestore")
+        log.info("Queueing transcription save to Firestore")
+        # Document IDs are generated client-side, so the ID is known up front
+        # and the write RPC runs as its own retried, acks_late task
         doc_ref = db.collection('voice_transcriptions').document()
-        doc_ref.set({
-            'transcription': transcription,
-            'audio_url': audio_url,
-            'timestamp': firestore.SERVER_TIMESTAMP,
-            'treatment_page': 'Treatment Eight',
-            'processed_by': 'python_backend',
-            'status': 'completed'
-        })
-        print(f"Saved to Firestore with ID: {doc_ref.id}")
+        save_transcription_task.delay(doc_ref.id, transcription, audio_url)
         return doc_ref.id
     except Exception as e:
-        print(f"Error saving to Firestore: {e}")
+        log.error(f"Error saving to Firestore: {e}")
         # Don't raise - continue without saving to Firestore
         return None
 
+def process_audio_url(audio_url, denoise=False):
+    """Download, transcribe and save one audio URL, returns the result dict"""
+    try:
+        # Known URL - skip the download entirely
+        transcription = get_cached_transcription(audio_url=audio_url, denoise=denoise)
+        cached = transcription is not None
+        
+        if not cached:
+            # Stream download through ffmpeg into in-memory PCM
+            pcm, audio_hash = download_and_decode(audio_url)
+            
+            # Same audio bytes seen before under a different URL
+            transcription = get_cached_transcription(audio_hash=audio_hash, denoise=denoise)
+            cached = transcription is not None
+        
+        if not cached:
+            transcription, success = transcribe_audio(pcm, denoise=denoise)
+            if success:
+                cache_transcription(audio_hash, transcription, denoise=denoise)
+        
+        log.info(f"Transcription completed: {transcription[:100]}..." if len(transcription) > 100 else f"Transcription: {transcription}")
+        
+        # Save to Firestore (optional - don't fail if this fails)
+        firestore_doc_id = save_to_firestore(transcription, audio_url)
+        
+        # Prepare result
+        result = {
+            'transcription': transcription,
+            'status': 'success',
+            'audio_url': audio_url,
+            'cached': cached
+        }
+        
+        if firestore_doc_id:
+            result['firestore_doc_id'] = firestore_doc_id
+        
+        return result
+        
+    except requests.RequestException as e:
+        error_msg = f"Error downloading audio file: {e}"
+        log.error(error_msg)
+        raise RuntimeError(error_msg)
+
+@celery.task(name='transcribe_task', bind=True, acks_late=True)
+def transcribe_task(self, audio_url, denoise=False):
+    """Background task: download, transcribe and save audio"""
+    log.info(f"Task {self.request.id} processing: {audio_url}")
+    return process_audio_url(audio_url, denoise)
+
+@celery.task(name='transcribe_batch_task', bind=True, acks_late=True)
+def transcribe_batch_task(self, audio_urls, denoise=False):
+    """Background task: transcribe several audio URLs concurrently"""
+    log.info(f"Task {self.request.id} processing batch of {len(audio_urls)} URLs")
+    
+    def process_one(audio_url):
+        # One failed URL shouldn't fail the whole batch
+        try:
+            return process_audio_url(audio_url, denoise)
+        except Exception as e:
+            log.error(f"Error processing {audio_url}: {e}")
+            return {'audio_url': audio_url, 'status': 'error', 'error': str(e)}
+    
+    # Downloads and ffmpeg are I/O bound and model inference releases the
+    # GIL, so threads overlap them; map() keeps results in request order
+    with ThreadPoolExecutor(max_workers=min(BATCH_WORKERS, len(audio_urls))) as executor:
+        results = list(executor.map(process_one, audio_urls))
+    
+    return {'results': results, 'status': 'success'}
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe_endpoint():
-    """Main endpoint for transcribing audio"""
-    temp_files = []  # Keep track of temp files to clean up
-    
+    """Main endpoint for transcribing audio - queues a background task"""
     try:
         # Get audio URL from request
         data = request.get_json()
         if not data:
-            return jsonify({'error': 'No JSON data provided'}), 400
+            return json_response({'error': 'No JSON data provided'}, 400)
             
         audio_url = data.get('audio_url')
         
         if not audio_url:
-            return jsonify({'error': 'No audio URL provided'}), 400
+            return json_response({'error': 'No audio URL provided'}, 400)
         
-        print(f"Processing transcription request for: {audio_url}")
+        # Voice activity filtering is off unless requested
+        denoise = data.get('denoise', False)
+        if not isinstance(denoise, bool):
+            return json_response({'error': 'denoise must be a boolean'}, 400)
         
-        # Download audio file
-        temp_audio_path = download_audio_file(audio_url)
-        temp_files.append(temp_audio_path)
+        # Cache hit - answer directly instead of queueing behind heavy jobs
+        transcription = get_cached_transcription(audio_url=audio_url, denoise=denoise)
+        if transcription is not None:
+            log.info(f"Cached transcription for: {audio_url}")
+            
+            # Every request is still recorded, same as the task path
+            firestore_doc_id = save_to_firestore(transcription, audio_url)
+            
+            response_data = {
+                'transcription': transcription,
+                'status': 'success',
+                'audio_url': audio_url,
+                'cached': True
+            }
+            
+            if firestore_doc_id:
+                response_data['firestore_doc_id'] = firestore_doc_id
+            
+            return json_response(response_data)
         
-        # Convert to WAV for better recognition
-        wav_path = convert_audio_to_wav(temp_audio_path)
-        if wav_path != temp_audio_path:
-            temp_files.append(wav_path)
+        log.info(f"Queueing transcription request for: {audio_url}")
         
-        # Transcribe audio
-        transcription = transcribe_audio(temp_audio_path)
+        task = transcribe_task.delay(audio_url, denoise)
         
-        print(f"Transcription completed: {transcription[:100]}..." if len(transcription) > 100 else f"Transcription: {transcription}")
+        return json_response({
+            'task_id': task.id,
+            'status': 'queued',
+            'status_url': f"/transcribe/{task.id}"
+        }, 202)
         
-        # Save to Firestore (optional - don't fail if this fails)
-        firestore_doc_id = save_to_firestore(transcription, audio_url)
+    except Exception as e:
+        error_msg = f"Error processing request: {e}"
+        log.error(error_msg)
+        return json_response({'error': error_msg}, 500)
+
+@app.route('/transcribe_batch', methods=['POST'])
+def transcribe_batch_endpoint():
+    """Queue a batch of audio URLs for transcription in one request"""
+    try:
+        data = request.get_json()
+        if not data:
+            return json_response({'error': 'No JSON data provided'}, 400)
         
-        # Prepare response
-        response_data = {
-            'transcription': transcription,
-            'status': 'success',
-            'audio_url': audio_url
-        }
+        audio_urls = data.get('audio_urls')
         
-        if firestore_doc_id:
-            response_data['firestore_doc_id'] = firestore_doc_id
+        if not audio_urls or not isinstance(audio_urls, list):
+            return json_response({'error': 'No audio URLs provided'}, 400)
         
-        return jsonify(response_data)
+        if len(audio_urls) > MAX_BATCH_SIZE:
+            return json_response({'error': f"Too many audio URLs - maximum is {MAX_BATCH_SIZE}"}, 400)
         
-    except requests.RequestException as e:
-        error_msg = f"Error downloading audio file: {e}"
-        print(error_msg)
-        return jsonify({'error': error_msg}), 400
+        denoise = data.get('denoise', False)
+        if not isinstance(denoise, bool):
+            return json_response({'error': 'denoise must be a boolean'}, 400)
+        
+        log.info(f"Queueing batch transcription request for {len(audio_urls)} URLs")
+        
+        task = transcribe_batch_task.delay(audio_urls, denoise)
+        
+        return json_response({
+            'task_id': task.id,
+            'status': 'queued',
+            'status_url': f"/transcribe/{task.id}"
+        }, 202)
         
     except Exception as e:
         error_msg = f"Error processing request: {e}"
-        print(error_msg)
-        return jsonify({'error': error_msg}), 500
+        log.error(error_msg)
+        return json_response({'error': error_msg}, 500)
+
+@app.route('/transcribe/<task_id>', methods=['GET'])
+def transcribe_status(task_id):
+    """Poll the status of a queued transcription task"""
+    try:
+        result = transcribe_task.AsyncResult(task_id)
         
-    finally:
-        # Clean up temporary files
-        for temp_file in temp_files:
-            try:
-                if os.path.exists(temp_file):
-                    os.unlink(temp_file)
-                    print(f"Cleaned up temp file: {temp_file}")
-            except Exception as e:
-                print(f"Error cleaning up {temp_file}: {e}")
+        if result.successful():
+            return json_response(result.result)
+        
+        if result.failed():
+            return json_response({
+                'task_id': task_id,
+                'status': 'failed',
+                'error': str(result.result)
+            }, 500)
+        
+        # PENDING, STARTED or RETRY
+        return json_response({
+            'task_id': task_id,
+            'status': result.state.lower()
+        }, 202)
+        
+    except Exception as e:
+        error_msg = f"Error fetching task status: {e}"
+        log.error(error_msg)
+        return json_response({'error': error_msg}, 500)
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     try:
-        # Check if Firebase is working
-        firebase_status = "connected" if db is not None else "not connected"
-        
-        return jsonify({
+        return json_response({
             'status': 'healthy',
             'service': 'speech-to-text',
-            'firebase': firebase_status,
-            'python_version': f"{os.sys.version_info.major}.{os.sys.version_info.minor}",
-            'environment': 'production' if os.environ.get('FIREBASE_SERVICE_ACCOUNT_KEY') else 'development'
+            'firebase': FIREBASE_STATUS,
+            'python_version': PYTHON_VERSION,
+            'environment': ENVIRONMENT
         })
     except Exception as e:
-        return jsonify({
+        return json_response({
             'status': 'unhealthy',
             'error': str(e)
-        }), 500
+        }, 500)
 
 @app.route('/', methods=['GET'])
 def home():
     """Home endpoint"""
-    return jsonify({
+    return json_response({
         'message': 'Flutter Voice Backend API',
         'version': '1.0.0',
         'endpoints': {
             'health': '/health - GET - Health check',
-            'transcribe': '/transcribe - POST - Transcribe audio to text'
+            'transcribe': '/transcribe - POST - Queue audio for transcription',
+            'transcribe_batch': '/transcribe_batch - POST - Queue several audio files for transcription',
+            'transcribe_status': '/transcribe/<task_id> - GET - Transcription task status'
         },
         'usage': {
             'transcribe': {
                 'method': 'POST',
                 'content-type': 'application/json',
-                'body': {'audio_url': 'https://example.com/audio.aac'},
+                'body': {'audio_url': 'https://example.com/audio.aac', 'denoise': False},
+                'response': {'task_id': 'task id', 'status': 'queued'},
+                'cached_response': {'transcription': 'transcribed text', 'status': 'success', 'cached': True}
+            },
+            'transcribe_batch': {
+                'method': 'POST',
+                'content-type': 'application/json',
+                'body': {'audio_urls': ['https://example.com/a.aac', 'https://example.com/b.aac']},
+                'response': {'task_id': 'task id', 'status': 'queued'}
+            },
+            'transcribe_status': {
+                'method': 'GET',
                 'response': {'transcription': 'transcribed text', 'status': 'success'}
             }
         }
@@ -262,35 +785,36 @@ def home():
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 errors"""
-    return jsonify({
+    return json_response({
         'error': 'Endpoint not found',
-        'available_endpoints': ['/', '/health', '/transcribe']
-    }), 404
+        'available_endpoints': ['/', '/health', '/transcribe', '/transcribe_batch', '/transcribe/<task_id>']
+    }, 404)
 
 @app.errorhandler(500)
 def internal_error(error):
     """Handle 500 errors"""
-    return jsonify({
+    return json_response({
         'error': 'Internal server error',
         'message': 'Something went wrong on our end'
-    }), 500
+    }, 500)
 
 if __name__ == '__main__':
     # Configuration for different environments
     port = int(os.environ.get('PORT', 5000))
     debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
     
-    print(f"Starting Flask app on port {port}")
-    print(f"Debug mode: {debug_mode}")
-    print(f"Environment: {'Production' if os.environ.get('FIREBASE_SERVICE_ACCOUNT_KEY') else 'Development'}")
+    log.info(f"Starting Flask app on port {port}")
+    log.info(f"Debug mode: {debug_mode}")
+    log.info(f"Environment: {ENVIRONMENT.capitalize()}")
     
     # Install required packages info
-    print("\n" + "="*50)
-    print("REQUIRED PACKAGES:")
-    print("pip install Flask SpeechRecognition pydub requests firebase-admin python-dotenv gunicorn")
-    print("\nSYSTEM DEPENDENCIES (for audio processing):")
-    print("- FFmpeg (optional but recommended)")
-    print("- PortAudio (for better audio handling)")
-    print("="*50 + "\n")
+    log.info("="*50)
+    log.info("REQUIRED PACKAGES:")
+    log.info("pip install Flask faster-whisper numpy requests firebase-admin python-dotenv gunicorn celery[redis]")
+    log.info("SYSTEM DEPENDENCIES (for audio processing):")
+    log.info("- FFmpeg (required for audio decoding)")
+    log.info("- Redis (Celery broker) + worker:")
+    log.info("  celery -A main.celery worker --concurrency=2 -Q transcription,firestore")
+    log.info("="*50)
     
     app.run(host='0.0.0.0', port=port, debug=debug_mode)
\ No newline at end of file